@@ -26,50 +26,18 @@ struct Block{
 
 // parse chain header and return all values from it
 // read chain file format explanation for extra info
+// the string is not modified, so it's safe to call from several threads
 struct Chain_info parse_head(char *header_string)
 {
     struct Chain_info head = {};
-    char *split_head = strtok(header_string, " ");
-    short int field = 0;
-    while(split_head) {
-        switch (field)
-        {
-            case 2:  // extract tName
-                strcpy(head.tName, split_head);
-                break;
-            case 3:
-                head.tSize = strtol(split_head, NULL, 10);
-                break;
-            case 4:
-                if (strcmp(split_head, "+") == 0) {head.tStrand = true;}
-                else {head.tStrand = false;}
-                break;
-            case 5:
-                head.tStart = strtol(split_head, NULL, 10);
-                break;
-            case 6:
-                head.tEnd = strtol(split_head, NULL, 10);
-                break;
-            case 7:
-                strcpy(head.qName, split_head);
-                break;
-            case 8:
-                head.qSize = strtol(split_head, NULL, 10);
-                break;
-            case 9:
-                if (strcmp(split_head, "+") == 0) {head.qStrand = true;}
-                else {head.qStrand = false;}
-                break;
-            case 10:
-                head.qStart = strtol(split_head, NULL, 10);
-                break;
-            case 11:
-                head.qEnd = strtol(split_head, NULL, 10); 
-                break;
-        }
-        split_head = strtok(NULL, " ");
-        field += 1;
-    }
+    char tStrand[2] = "";
+    char qStrand[2] = "";
+    // chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+    sscanf(header_string, "%*s %*s %254s %d %1s %d %d %254s %d %1s %d %d",
+           head.tName, &head.tSize, tStrand, &head.tStart, &head.tEnd,
+           head.qName, &head.qSize, qStrand, &head.qStart, &head.qEnd);
+    head.tStrand = (strcmp(tStrand, "+") == 0);
+    head.qStrand = (strcmp(qStrand, "+") == 0);
     return head;
 }
 
@@ -79,22 +47,12 @@ struct Chain_info parse_head(char *header_string)
 struct Block parse_block(char *block_string)
 {
     struct Block block = {};
-    // default values
-    block.size = 0;
-    block.dq = 0;
-    block.dt = 0;
-
-    char *split_block = strtok(block_string, "\t");
-    short int field = 0;
-    while (split_block) {
-        switch (field) {
-            case 0: block.size = strtol(split_block, NULL, 10); break;
-            case 1: block.dt = strtol(split_block, NULL, 10); break;
-            case 2: block.dq = strtol(split_block, NULL, 10); break;
-        }
-        split_block = strtok(NULL, "\t");
-        field += 1;
-    }
+    // default values: the last block has size field only
+    // strtol returns 0 if there is nothing to read
+    char *field_end;
+    block.size = strtol(block_string, &field_end, 10);
+    block.dt = strtol(field_end, &field_end, 10);
+    block.dq = strtol(field_end, &field_end, 10);
     return block;
 }
 
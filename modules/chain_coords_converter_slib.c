@@ -17,23 +17,19 @@ Author: Bogdan Kirilenko, 2020;
 #define NUM_BASE 10
 
 
-char ** chain_coords_converter(char *chain, int shift, int regions_num, char **granges)
+struct Chain_info convert_regions(char *chain, int shift, int regions_num, char **granges,
+                                  struct Regions *t_regions, int *starts_in_q, int *ends_in_q)
 {
+    // map regions to the query genome; fill t_regions, starts_in_q and ends_in_q
+    // arrays (each of regions_num length) and return parsed chain header
     // parse region from argv[2]; looks like chromN:start-end
-    struct Regions t_regions[regions_num];
 
     for (int i = 0; i < regions_num; i++)
     {
         // parse regions; their format should be chrom:start-end
-        int reg_index = i;
-        char *current_region = granges[i];
-        char *reg_split = strtok(current_region, ":");
-        strcpy(t_regions[reg_index].chrom, reg_split);
-        reg_split = strtok(NULL, ":");
-        char *split_range = strtok(reg_split, "-");
-        t_regions[reg_index].start = strtol(split_range, NULL, NUM_BASE);
-        split_range = strtok(NULL, "-");
-        t_regions[reg_index].end = strtol(split_range, NULL, NUM_BASE);
+        // sscanf doesn't modify granges and is thread-safe unlike strtok
+        sscanf(granges[i], "%254[^:]:%d-%d", t_regions[i].chrom,
+               &t_regions[i].start, &t_regions[i].end);
     }  // end regions parsing
 
     for (int i = 0; i<regions_num; i++)
@@ -62,8 +58,6 @@ char ** chain_coords_converter(char *chain, int shift, int regions_num, char **g
     struct Chain_info head;  // parse head information there
 
     // variables to collect the results I need
-    int starts_in_q[regions_num];
-    int ends_in_q[regions_num];
     memset(starts_in_q, 0, regions_num * sizeof(int));
     memset(ends_in_q, 0, regions_num * sizeof(int));
 
@@ -274,6 +268,20 @@ char ** chain_coords_converter(char *chain, int shift, int regions_num, char **g
         }
     }
 
+    free(starts_buff);
+    free(ks);
+    return head;
+}
+
+
+char ** chain_coords_converter(char *chain, int shift, int regions_num, char **granges)
+{
+    struct Regions t_regions[regions_num];
+    int starts_in_q[regions_num];
+    int ends_in_q[regions_num];
+    struct Chain_info head = convert_regions(chain, shift, regions_num, granges,
+                                             t_regions, starts_in_q, ends_in_q);
+
     // convert 1\0 (C) to +\- (human-readable)
     char *tStrand = (head.tStrand == 1) ? "+" : "-";
     char *qStrand = (head.qStrand == 1) ? "+" : "-";
@@ -302,6 +310,37 @@ char ** chain_coords_converter(char *chain, int shift, int regions_num, char **g
     return answer;
 }
 
+
+void chain_coords_converter_batch(char **chains, int chains_num, int *granges_per_chain,
+                                  char **granges, int shift, int64_t *answer)
+{
+    // the same as chain_coords_converter but for a number of chains at once
+    // granges are concatenated: first granges_per_chain[0] belong to the chain 0 and so on
+    // answer should be allocated by the caller: 5 values for each region
+    // region number within the chain, q_start, q_end, t_start, t_end
+    int granges_shift = 0;
+
+    for (int i = 0; i < chains_num; i++)
+    {
+        int regions_num = granges_per_chain[i];
+        struct Regions t_regions[regions_num];
+        int starts_in_q[regions_num];
+        int ends_in_q[regions_num];
+        convert_regions(chains[i], shift, regions_num, &granges[granges_shift],
+                        t_regions, starts_in_q, ends_in_q);
+        for (int j = 0; j < regions_num; j++)
+        {
+            int64_t *record = &answer[(granges_shift + j) * 5];
+            record[0] = j;
+            record[1] = starts_in_q[j];
+            record[2] = ends_in_q[j];
+            record[3] = t_regions[j].start;
+            record[4] = t_regions[j].end;
+        }
+        granges_shift += regions_num;
+    }
+}
+
 int main()
 {
     // should be compiled with -fPIC and -shared flags!
@@ -9,6 +9,8 @@ __version__ = "1.0"
 __email__ = "kirilenk@mpi-cbg.de"
 __credits__ = ["Michael Hiller", "Virag Sharma", "David Jebb"]
 
+CHAIN_HEADER_READ_LEN = 512  # chain headers are shorter as a rule
+
 
 def parts(lst, n=3):
     """Split an iterable into parts with size n."""
@@ -30,6 +32,22 @@ def bedExtractID(index_file, gene_ids):
     return bed_lines
 
 
+def bedExtractIDs(index_file, gene_ids):
+    """Extract gene_id: bed_line dict from BDB file."""
+    db = bsddb3.btopen(index_file, "r")
+    bed_lines = {}
+    for gene_id in sorted(set(str(x) for x in gene_ids)):
+        bed_line_enc = db.get(gene_id.encode())
+        if not bed_line_enc:
+            continue
+        bed_lines[gene_id] = bed_line_enc.decode("utf-8")
+    db.close()
+    if len(bed_lines) == 0:
+        sys.stderr.write("Error! Bed tracks not found! (bedExtractIDs)")
+        sys.exit(1)
+    return bed_lines
+
+
 def bedExtractIDText(bed_file, gene_ids_param):
     """Extract bed-12 tracks according the gene names."""
     if type(gene_ids_param) != str:  # so it's list
@@ -112,6 +130,41 @@ def chainExtractID(index_file, chain_id):
     return chain_data
 
 
+def chainExtractIDs(index_file, chain_ids):
+    """Extract chain_id: chain_body dict from BDB file."""
+    db = bsddb3.btopen(index_file, "r")
+    chains = {}
+    for chain_id in sorted(set(str(x) for x in chain_ids)):
+        chain_data_enc = db.get(chain_id.encode())
+        if not chain_data_enc:
+            sys.stderr.write("Error! Chain {} not found in the bdb. Abort\n".format(chain_id))
+            sys.exit(1)
+        chains[chain_id] = chain_data_enc.decode("utf-8")
+    db.close()
+    return chains
+
+
+def chainHeaderExtractIDs(index_file, chain_ids):
+    """Extract chain headers from BDB file without reading chain bodies."""
+    db = bsddb3.btopen(index_file, "r")
+    headers = {}
+    for chain_id in sorted(set(str(x) for x in chain_ids)):
+        key = chain_id.encode()
+        read_len = CHAIN_HEADER_READ_LEN
+        while True:
+            chain_start = db.db.get(key, default=None, dlen=read_len, doff=0)
+            if not chain_start:
+                sys.stderr.write("Error! Chain {} not found in the bdb. Abort\n".format(chain_id))
+                sys.exit(1)
+            # got the entire header or the entire record
+            if b"\n" in chain_start or len(chain_start) < read_len:
+                break
+            read_len *= 2
+        headers[chain_id] = chain_start.split(b"\n", 1)[0].decode("utf-8")
+    db.close()
+    return headers
+
+
 def flatten(lst):
     """Flat list out of list of lists."""
     return [item for sublist in lst for item in sublist]
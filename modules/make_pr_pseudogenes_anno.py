@@ -3,15 +3,18 @@
 import argparse
 import sys
 from collections import defaultdict
+import numpy as np
 try:
-    from modules.common import chainExtractID
-    from modules.common import bedExtractID
+    from modules.common import chainHeaderExtractIDs
+    from modules.common import bedExtractIDs
 except ImportError:
-    from common import chainExtractID
-    from common import bedExtractID
+    from common import chainHeaderExtractIDs
+    from common import bedExtractIDs
 
 PINK_COLOR = "250,50,200"
 DEF_SCORE = 100
+BED_LINE_TEMPLATE = b"%s\t%d\t%d\t%s\t" + str(DEF_SCORE).encode() + \
+    b"\t%s\t%d\t%d\t" + PINK_COLOR.encode() + b"\n"
 
 
 def parse_args():
@@ -48,50 +51,62 @@ def get_pp_gene_chains(chain_class_file):
 def get_corr_q_regions(gene_to_pp_chains, chain_bdb, bed_bdb):
     """Create projection: q region dict."""
     proj_to_q_reg = {}
+    if not gene_to_pp_chains:
+        # no processed pseudogenes, nothing to fetch
+        return proj_to_q_reg
+    # fetch all the bed tracks and chains at once
+    all_genes = list(gene_to_pp_chains.keys())
+    all_chains = sorted({c for cs in gene_to_pp_chains.values() for c in cs})
+    gene_to_track = bedExtractIDs(bed_bdb, all_genes)
+    # only chain headers are needed, do not read chain bodies
+    chain_to_header = chainHeaderExtractIDs(chain_bdb, all_chains)
+
+    # parse chain headers, each chain once
+    chain_ids = list(chain_to_header.keys())
+    chain_index = {chain_id: num for num, chain_id in enumerate(chain_ids)}
+    headers = [chain_to_header[chain_id].split() for chain_id in chain_ids]
+    q_chroms = [header[7] for header in headers]
+    q_sizes = np.array([int(header[8]) for header in headers], dtype=np.int64)
+    q_neg = np.array([header[9] == "-" for header in headers], dtype=bool)
+    q_starts = np.array([int(header[10]) for header in headers], dtype=np.int64)
+    q_ends = np.array([int(header[11]) for header in headers], dtype=np.int64)
+    # chain coordinates are given for the strand, convert them to "+"
+    q_starts, q_ends = np.where(q_neg, q_sizes - q_ends, q_starts), \
+        np.where(q_neg, q_sizes - q_starts, q_ends)
+
+    # collect gene: chain pairs
+    projections, proj_chain_nums, gene_neg = [], [], []
     for gene, chains in gene_to_pp_chains.items():
-        gene_track = bedExtractID(bed_bdb, gene).rstrip().split("\t")
-        gene_strand = gene_track[5]
+        gene_track_raw = gene_to_track.get(gene)
+        if not gene_track_raw:
+            sys.exit(f"Error! Bed track for {gene} not found! (get_corr_q_regions)")
+        gene_track = gene_track_raw.rstrip().split("\t")
+        gene_strand_neg = gene_track[5] == "-"
         for chain_id in chains:
-            projection = f"{gene}.{chain_id}"
-            chain_body = chainExtractID(chain_bdb, chain_id)
-            chain_header = chain_body.split("\n")[0].split()
-            q_chrom = chain_header[7]
-            q_size = int(chain_header[8])
-            q_strand = chain_header[9]
-            q_start = int(chain_header[10])
-            q_end = int(chain_header[11])
-            if q_strand == "-":
-                t_ = q_start
-                q_start = q_size - q_end
-                q_end = q_size - t_
-            proj_strand = "+" if q_strand == gene_strand else "-"
-            proj_reg = (q_chrom, proj_strand, q_start, q_end)
-            proj_to_q_reg[projection] = proj_reg
+            projections.append(f"{gene}.{chain_id}")
+            proj_chain_nums.append(chain_index[str(chain_id)])
+            gene_neg.append(gene_strand_neg)
+
+    # projection is on "+" if chain and gene strands are the same
+    proj_chain_nums = np.array(proj_chain_nums, dtype=np.int64)
+    proj_strands = np.where(q_neg[proj_chain_nums] ^ np.array(gene_neg, dtype=bool), "-", "+")
+    for projection, chain_num, proj_strand, q_start, q_end in zip(projections,
+                                                                  proj_chain_nums.tolist(),
+                                                                  proj_strands.tolist(),
+                                                                  q_starts[proj_chain_nums].tolist(),
+                                                                  q_ends[proj_chain_nums].tolist()):
+        proj_to_q_reg[projection] = (q_chroms[chain_num], proj_strand, q_start, q_end)
     return proj_to_q_reg
 
 
-def make_bed_lines(proj_to_reg):
-    """Create bed9 lines."""
-    bed_lines = []
+def save_bed(proj_to_reg, bed_file):
+    """Write bed9 lines straight to the file."""
+    f = open(bed_file, "wb", buffering=1 << 20)
     for name, region in proj_to_reg.items():
-        chrom = region[0]
-        strand = region[1]
-        chrom_start = region[2]
-        chrom_end = region[3]
-        # non coding region: then thick_start = thick_end
-        thick_start = chrom_start
-        thick_end = chrom_start
-        line_data = (chrom, chrom_start, chrom_end, name, DEF_SCORE, strand, thick_start, thick_end, PINK_COLOR)
-        line = "\t".join(str(x) for x in line_data)
-        bed_lines.append(line)
-    return bed_lines
-
-
-def save_bed(bed_lines, bed_file):
-    """Save bed file."""
-    f = open(bed_file, "w")
-    f.write("\n".join(bed_lines))
-    f.write("\n")
+        chrom, strand, chrom_start, chrom_end = region
+        # non coding region: then thick_start = thick_end = chrom_start
+        f.write(BED_LINE_TEMPLATE % (chrom.encode(), chrom_start, chrom_end, name.encode(),
+                                     strand.encode(), chrom_start, chrom_start))
     f.close()
 
 
@@ -99,8 +114,7 @@ def create_ppgene_track(chain_class_file, chain_bdb, bed_bdb, output):
     """Create ppgene track."""
     gene_to_pp_chains = get_pp_gene_chains(chain_class_file)
     projection_to_reg = get_corr_q_regions(gene_to_pp_chains, chain_bdb, bed_bdb)
-    bed_lines = make_bed_lines(projection_to_reg)
-    save_bed(bed_lines, output)
+    save_bed(projection_to_reg, output)
 
 if __name__ == "__main__":
     args = parse_args()
@@ -9,26 +9,35 @@ import argparse
 import os
 import sys
 import math
+import time
+import mmap
+import itertools
+import functools
+import queue
 from collections import defaultdict
 from datetime import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import ctypes
-from modules.common import parts, chainExtractID
+import numpy as np
+import pandas as pd
+from modules.common import parts, chainExtractIDs
 
 __author__ = "Bogdan Kirilenko, 2020."
 __version__ = "1.0"
 __email__ = "kirilenk@mpi-cbg.de"
 __credits__ = ["Michael Hiller", "Virag Sharma", "David Jebb"]
 
-# 0 gene; 1 chains; 2 bed_file; 3 bdb_chain_file; 4 tDB; 5 qDB; 6 memlim gig;
 LOCATION = os.path.dirname(__file__)
-WRAPPER_TEMPLATE = os.path.join(LOCATION, "CESAR_wrapper.py") \
-                   + " {0} {1} {2} {3} {4} {5} --memlim {6} --cesar_binary {7}" \
-                   + " --uhq_flank {8}"
+CESAR_WRAPPER = os.path.join(LOCATION, "CESAR_wrapper.py")
 GA_TEMPLATE = os.path.join(LOCATION, "CESAR_wrapper.py") \
               + " {0} {1} {2} {3} {4} {5} -g"
 CESAR_RUNNER = os.path.join(LOCATION, "cesar_runner.py")
 LONG_LOCI_FIELDS = {"GGLOB", "TRANS"}
+ORTHOLOGS_COLUMNS = {"ORTH": 1, "PARA": 2, "TRANS": 3}
 CHUNK_SIZE = 1000
+CHAINS_BATCH_SIZE = 100
+MAX_CONVERT_THREADS = 4
+PROGRESS_INTERVAL = 0.5  # seconds between progress messages
 REL_LENGTH_THR = 50
 ABS_LENGTH_TRH = 500000
 
@@ -43,6 +52,15 @@ ch_lib.chain_coords_converter.argtypes = [ctypes.c_char_p,
                                           ctypes.c_int,
                                           ctypes.POINTER(ctypes.c_char_p)]
 ch_lib.chain_coords_converter.restype = ctypes.POINTER(ctypes.c_char_p)
+ch_lib.chain_coords_converter_batch.argtypes = [ctypes.POINTER(ctypes.c_char_p),
+                                                ctypes.c_int,
+                                                ctypes.POINTER(ctypes.c_int),
+                                                ctypes.POINTER(ctypes.c_char_p),
+                                                ctypes.c_int,
+                                                ctypes.POINTER(ctypes.c_int64)]
+ch_lib.chain_coords_converter_batch.restype = None
+# chain_coords_converter_batch output: num, q_start, q_end, t_start, t_end
+CONV_REC_LEN = 5
 
 
 def eprint(msg, end="\n"):
@@ -150,79 +168,165 @@ def define_buckets(lim, buckets):
 def read_orthologs(orthologs_file, fields_raw, only_o2o=False):
     """Read orthologs file."""
     fields = [x.upper() for x in fields_raw.split(",") if x != ""]
+    # get column numbers once, other fields are not presented in the file
+    field_idx = [(field, ORTHOLOGS_COLUMNS[field]) for field in fields
+                 if field in ORTHOLOGS_COLUMNS]
     genes_chains = {}
     chain_gene_field = {}
     skipped = []  # genes skipped at this stage
-    f = open(orthologs_file)
+    if os.path.getsize(orthologs_file) == 0:
+        # an empty file cannot be mapped to memory
+        die(f"Error! Orthologs file {orthologs_file} is empty!", rc=1)
+
+    # map the file to memory and scan lines there
+    with open(orthologs_file, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in iter(mm.readline, b""):
+            line_info = line.rstrip(b"\r\n").split(b"\t", 5)
+            if line_info[0] == b"GENE":
+                # this is a header line, skip it
+                continue
+            # "0" is a filler meaning "no chains there"
+            gene = line_info[0].decode()
+            selected = []
+            # Processed pseudogenes column ignored
+            orth, para, trans = (tuple(col.decode().split(",")) if col != b"0" else ()
+                                 for col in line_info[1:4])
+            chains = (None, orth, para, trans)  # index -> column number
+
+            if not (orth or para or trans):
+                # no way in running CESAR on this gene
+                skipped.append((gene, "0", "No chains intersecting the gene"))
+                continue
+            not_one2one = len(orth) == 0 or len(orth) > 1
+            if only_o2o and not_one2one:  # we requested only a single orthologous chain
+                skipped.append((gene, "0", "Only one2one requested, this gene didn't pass"))
+                continue
 
-    for line in f:
-        # parse line
-        line_info = line[:-1].split("\t")
-        if line_info[0] == "GENE":
-            # this is a header line, skip it
-            continue
-        # "0" is a filler meaning "no chains there"
-        gene = line_info[0]
-        selected, chains = [], {}
-
-        chains["ORTH"] = [x for x in line_info[1].split(",") if x != "0"]
-        chains["PARA"] = [x for x in line_info[2].split(",") if x != "0"]
-        chains["TRANS"] = [x for x in line_info[3].split(",") if x != "0"]
-        # Processed pseudogenes column ignored
-        all_chains = chains["ORTH"] + chains["PARA"] + chains["TRANS"]
-
-        if len(all_chains) == 0:
-            # no way in running CESAR on this gene
-            skipped.append((gene, "0", "No chains intersecting the gene"))
-            continue
-        not_one2one = len(chains["ORTH"]) == 0 or len(chains["ORTH"]) > 1
-        if only_o2o and not_one2one:  # we requested only a single orthologous chain
-            skipped.append((gene, "0", "Only one2one requested, this gene didn't pass"))
-            continue
+            # get those are chosen in FIELDS
+            for field, idx in field_idx:
+                field_chains = chains[idx]
+                if not field_chains:
+                    continue
+                selected += field_chains
+                chain_gene_field.update(((chain, gene), field) for chain in field_chains)
 
-        # get those are chosen in FIELDS
-        for field in fields:
-            field_chains = chains.get(field)
-            if not field_chains:
-                continue
-            selected.extend(field_chains)
-            for chain in field_chains:
-                key = (chain, gene)
-                chain_gene_field[key] = field
-
-        # if a gene has no orthologous chains, then use paralogous
-        # if no paralogous -> log this gene
-        if not selected:
-            # no orthologous chains
-            selected = all_chains.copy()
-            keys = [(chain, gene) for chain in selected]
-            for key in keys:
-                chain_gene_field[key] = "PARALOG"
-
-        genes_chains[gene] = selected
+            # if a gene has no orthologous chains, then use paralogous
+            # if no paralogous -> log this gene
+            if not selected:
+                # no orthologous chains
+                selected = list(itertools.chain(orth, para, trans))
+                chain_gene_field.update(((chain, gene), "PARALOG") for chain in selected)
+
+            genes_chains[gene] = selected
 
-    f.close()
     die("Error! No gene:chains pairs selected! Probably --fields parameter is wrong!") \
         if len(genes_chains) == 0 else None
     return genes_chains, chain_gene_field, skipped
 
 
 def read_bed(bed):
-    """Read bed file."""
-    bed_data = {}
-    f = open(bed, "r")
-    for line in f:
-        bed_info = line[:-1].split("\t")
-        chrom = bed_info[0]
-        chromStart = int(bed_info[1])
-        chromEnd = int(bed_info[2])
-        name = bed_info[3]
-        blockSizes = [int(x) for x in bed_info[10].split(',') if x != '']
-        bed_data[name] = (chrom, chromStart, chromEnd, blockSizes)
-    f.close()
+    """Read bed file.
+
+    Return name: (chrom, chromStart, chromEnd, num_states, rlength) dict,
+    the last two values are required for CESAR memory estimation.
+    """
+    # na_filter=False: names like NA or null are valid transcript and chrom names
+    bed_df = pd.read_csv(bed, sep="\t", header=None, usecols=[0, 1, 2, 3, 10],
+                         names=["chrom", "chromStart", "chromEnd", "name", "blockSizes"],
+                         dtype={"chrom": str, "chromStart": np.int64, "chromEnd": np.int64,
+                                "name": str, "blockSizes": str}, na_filter=False)
+    # parse block sizes of all transcripts at once
+    block_sizes_str = bed_df["blockSizes"].str.rstrip(",")
+    all_block_sizes_str = ",".join(block_sizes_str)
+    if ",," in all_block_sizes_str or all_block_sizes_str.startswith(","):
+        # empty entries like in "100,,200," or empty fields: drop them
+        block_sizes_str = block_sizes_str.str.replace(r",+", ",", regex=True).str.strip(",")
+        all_block_sizes_str = ",".join(block_sizes_str[block_sizes_str != ""])
+    # count blocks from blockSizes itself: do not rely on the blockCount column
+    block_counts = np.where(block_sizes_str.to_numpy() != "",
+                            block_sizes_str.str.count(",").to_numpy() + 1, 0)
+    try:
+        all_block_sizes = np.fromstring(all_block_sizes_str, sep=",", dtype=np.int64)
+    except ValueError:  # not a number somewhere
+        all_block_sizes = None
+    if all_block_sizes is None or block_counts.sum() != len(all_block_sizes):
+        die(f"Error! Cannot parse blockSizes fields in {bed}!", rc=1)
+    block_rows = np.repeat(np.arange(len(bed_df)), block_counts)
+    # precompute values required for memory estimation
+    # num_states += 6 + 6 * reference->num_codons + 1 + 2 + 2 + 22 + 6;
+    #  /* 22 and 6 for acc and donor states */
+    block_states = 6 + 6 * (all_block_sizes // 3) + 1 + 2 + 2 + 22 + 6
+    num_states = np.bincount(block_rows, weights=block_states,
+                             minlength=len(bed_df)).astype(np.int64)
+    # rlength += 11 + 6 * fasta.references[i]->length
+    # + donors[i]->length + acceptors[i]->length;
+    rlength = np.bincount(block_rows, weights=all_block_sizes,
+                          minlength=len(bed_df)).astype(np.int64)
+    bed_data = dict(zip(bed_df["name"].tolist(), zip(bed_df["chrom"].tolist(),
+                                                     bed_df["chromStart"].tolist(),
+                                                     bed_df["chromEnd"].tolist(),
+                                                     num_states.tolist(),
+                                                     rlength.tolist())))
     return bed_data
 
 
+def make_c_buffers(max_granges_num):
+    """Allocate C arrays for chain_coords_converter_batch call."""
+    c_chains = (ctypes.c_char_p * CHAINS_BATCH_SIZE)()
+    c_granges_per_chain = (ctypes.c_int * CHAINS_BATCH_SIZE)()
+    granges_arr = (ctypes.c_char_p * (max_granges_num + 1))()
+    c_conv_out = (ctypes.c_int64 * (max_granges_num * CONV_REC_LEN))()
+    return c_chains, c_granges_per_chain, granges_arr, c_conv_out
+
+
+def convert_chains_batch(batch_chain_ids, chain_to_genes, grange_bytes,
+                         bdb_chain_file, c_buffers_pool):
+    """Project genes through a batch of chains.
+
+    Return (chain_id, gene) pairs, query region lengths and
+    too long query locus flags.
+    """
+    # extract chains + get ranges for genes for the whole batch of chains
+    chain_to_body = chainExtractIDs(bdb_chain_file, batch_chain_ids)
+    # using shared lib to get corresponding regions
+    # we need to convert python datatypes to C types
+    # C arrays are reused: take a free set of them from the pool
+    c_chains, c_granges_per_chain, granges_arr, c_conv_out = c_buffers = c_buffers_pool.get()
+    try:
+        chain_gene_pairs = []
+        for chain_num, chain_id in enumerate(batch_chain_ids):
+            genes = chain_to_genes[chain_id]
+            c_chains[chain_num] = chain_to_body[chain_id].encode()
+            c_granges_per_chain[chain_num] = len(genes)
+            for gene in genes:
+                granges_arr[len(chain_gene_pairs)] = grange_bytes[gene]
+                chain_gene_pairs.append((chain_id, gene))
+        granges_num = len(chain_gene_pairs)
+        granges_arr[granges_num] = None
+        # then call the function, all chains of the batch are processed at once
+        # ctypes releases the GIL, so other batches are processed meanwhile
+        ch_lib.chain_coords_converter_batch(c_chains,
+                                            ctypes.c_int(len(batch_chain_ids)),
+                                            c_granges_per_chain,
+                                            granges_arr,
+                                            ctypes.c_int(2),
+                                            c_conv_out)
+        # C output is a packed array: one record per chain: gene pair
+        conv_out = np.frombuffer(c_conv_out, dtype=np.int64,
+                                 count=granges_num * CONV_REC_LEN).reshape(-1, CONV_REC_LEN)
+        que_lens = conv_out[:, 2] - conv_out[:, 1]
+        tar_lens = conv_out[:, 4] - conv_out[:, 3]
+    finally:
+        c_buffers_pool.put(c_buffers)
+    len_deltas = np.abs(tar_lens - que_lens)
+    delta_gene_times = len_deltas / tar_lens
+    high_rel_len = delta_gene_times > REL_LENGTH_THR
+    high_abs_len = len_deltas > ABS_LENGTH_TRH
+    too_long = high_rel_len | high_abs_len
+    return chain_gene_pairs, que_lens.tolist(), too_long.tolist()
+
+
 def precompute_regions(batch, bed_data, bdb_chain_file, chain_gene_field, limit):
     """Precompute region for each chain: bed pair."""
     eprint("Precompute regions for each gene:chain pair...")
@@ -238,67 +342,58 @@ def precompute_regions(batch, bed_data, bdb_chain_file, chain_gene_field, limit)
         if len(chains) > limit:
             skipped.append((gene, ",".join(chains_[limit:]),
                             f"number of chains ({limit} chains) limit exceeded"))
-        for chain in chains_:
+        # a chain might be listed in several fields, process it once
+        for chain in dict.fromkeys(chains_):
             chain_to_genes[chain].append(gene)
     # read regions themselves
-    gene_chain_grange = defaultdict(dict)
-    chains_num, iter_num = len(chain_to_genes.keys()), 0
-
-    for chain_id, genes in chain_to_genes.items():
-        # extract chain itself + get ranges for genes
-        chain_body = chainExtractID(bdb_chain_file, chain_id).encode()
-        all_gene_ranges = []
+    # gene: [(chain_id, query region length), ...] and gene: max query region length
+    gene_chain_grange, gene_qmax = defaultdict(list), {}
+    chain_ids = list(chain_to_genes.keys())
+    chains_num, iter_num = len(chain_ids), 0
+
+    chain_batches = parts(chain_ids, n=CHAINS_BATCH_SIZE)
+    # encode gene ranges once: the C function does not modify them
+    grange_bytes = {}
+    for genes in chain_to_genes.values():
         for gene in genes:
             gene_data = bed_data.get(gene)
-            grange = f"{gene_data[0]}:{gene_data[1]}-{gene_data[2]}"
-            all_gene_ranges.append(grange)
-            
-        # using shared lib to get corresponding regions
-        # we need to convert python datatypes to C types
-        c_chain = ctypes.c_char_p(chain_body)
-        c_shift = ctypes.c_int(2)
-        granges_bytes = [s.encode("utf-8") for s in all_gene_ranges]
-        granges_num = len(all_gene_ranges)
-        c_granges_num = ctypes.c_int(granges_num)
-        granges_arr = (ctypes.c_char_p * (granges_num + 1))()
-        granges_arr[:-1] = granges_bytes
-        granges_arr[granges_num] = None
-        # then call the function
-
-        raw_ch_conv_out = ch_lib.chain_coords_converter(c_chain,
-                                                        c_shift,
-                                                        c_granges_num,
-                                                        granges_arr)
-        chain_coords_conv_out = []  # keep lines here
-        # convert C output to python-readible type
-        for i in range(granges_num + 1):
-            chain_coords_conv_out.append(raw_ch_conv_out[i].decode("utf-8"))
-
-        for line in chain_coords_conv_out[1:]:
-            line_info = line[:-1].split()
-            num = int(line_info[0])
-            q_grange = line_info[1].split(":")[1].split("-")
-            q_start, q_end = int(q_grange[0]), int(q_grange[1])
-            que_len = q_end - q_start
-            t_grange = line_info[2].split(":")[1].split("-")
-            t_start, t_end = int(t_grange[0]), int(t_grange[1])
-            tar_len = t_end - t_start
-            len_delta = abs(tar_len - que_len)
-            delta_gene_times = len_delta / tar_len
-            gene = genes[num]
-            field = chain_gene_field.get((chain_id, gene))
-            high_rel_len = delta_gene_times > REL_LENGTH_THR
-            high_abs_len = len_delta > ABS_LENGTH_TRH
-            long_loci_field = field in LONG_LOCI_FIELDS
-            if (high_rel_len or high_abs_len) and long_loci_field:
-                skipped.append((gene, chain_id, "too long query locus"))
-                continue
-            gene_chain_grange[gene][chain_id] = que_len
-        # not sure if necessary but...
-        del raw_ch_conv_out
-        iter_num += 1
-        eprint(f"Chain {iter_num} / {chains_num}", end="\r")
-    return gene_chain_grange, skipped
+            grange_bytes[gene] = f"{gene_data[0]}:{gene_data[1]}-{gene_data[2]}".encode("utf-8")
+
+    # C arrays are allocated once for the largest batch, a set for each thread
+    max_granges_num = max((sum(len(chain_to_genes[c]) for c in batch_chain_ids)
+                           for batch_chain_ids in chain_batches), default=0)
+    # each thread keeps a batch of chain bodies in memory, so keep their number small
+    cpus_num = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+        else os.cpu_count() or 1
+    threads_num = max(1, min(cpus_num, MAX_CONVERT_THREADS, len(chain_batches)))
+    c_buffers_pool = queue.Queue()
+    for _ in range(threads_num):
+        c_buffers_pool.put(make_c_buffers(max_granges_num))
+    convert_batch = functools.partial(convert_chains_batch,
+                                      chain_to_genes=chain_to_genes,
+                                      grange_bytes=grange_bytes,
+                                      bdb_chain_file=bdb_chain_file,
+                                      c_buffers_pool=c_buffers_pool)
+
+    last_report = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads_num) as executor:
+        # map keeps the batches order, so the output doesn't depend on threads
+        for chain_gene_pairs, que_lens, too_long in executor.map(convert_batch, chain_batches):
+            for (chain_id, gene), que_len, too_long_ in zip(chain_gene_pairs, que_lens, too_long):
+                field = chain_gene_field.get((chain_id, gene))
+                long_loci_field = field in LONG_LOCI_FIELDS
+                if too_long_ and long_loci_field:
+                    skipped.append((gene, chain_id, "too long query locus"))
+                    continue
+                gene_chain_grange[gene].append((chain_id, que_len))
+                gene_qmax[gene] = max(gene_qmax.get(gene, que_len), que_len)
+            iter_num = min(iter_num + CHAINS_BATCH_SIZE, chains_num)
+            # do not flood stderr: report progress at most once per interval
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL or iter_num == chains_num:
+                eprint(f"Chain {iter_num} / {chains_num}", end="\r")
+                last_report = now
+    return gene_chain_grange, gene_qmax, skipped
 
 
 def fill_buckets(buckets, all_jobs):
@@ -307,11 +402,15 @@ def fill_buckets(buckets, all_jobs):
         buckets[0] = list(all_jobs.keys())
         return buckets
     # buckets were set
-    memlims = sorted(buckets.keys())
-    prev_lim = 0
-    for memlim in memlims:
-        buckets[memlim] = [job for job, jobmem in all_jobs.items() if prev_lim < jobmem <= memlim]
-        prev_lim = memlim
+    # bucket i takes jobs with memlims[i - 1] < jobmem <= memlims[i]
+    jobs = list(all_jobs.keys())
+    jobs_mem = np.fromiter(all_jobs.values(), dtype=np.float64, count=len(jobs))
+    memlims = np.array(sorted(buckets.keys()), dtype=np.float64)
+    bucket_idx = np.searchsorted(memlims, jobs_mem, side="left")
+    # jobs requiring more than the max limit or <= 0 fit no bucket
+    bucket_idx[jobs_mem <= 0] = len(memlims)
+    for num, memlim in enumerate(sorted(buckets.keys())):
+        buckets[memlim] = [jobs[i] for i in np.flatnonzero(bucket_idx == num)]
     # remove empty
     filter_buckets = {k: v for k, v in buckets.items() if len(v) > 0}
     return filter_buckets
@@ -327,14 +426,17 @@ def save_jobs(filled_buckets, bucket_jobs_num, jobs_dir):
         num_of_files = len(jobs) if num_of_files >= len(jobs) else num_of_files
         size_of_file = len(jobs) // num_of_files
         # size_of_file = size_of_file + 1 if len(jobs) % num_of_files != 0 else size_of_file
-        jobs_split = parts(jobs, n=size_of_file)
-        for part in jobs_split:
+        # encode all jobs once, then write each part as a single buffer
+        jobs_bytes = [job.encode() for job in jobs]
+        for part in parts(jobs_bytes, n=size_of_file):
             file_num += 1
             file_name = f"cesar_job_{file_num}_{bucket_id}"
             file_path = os.path.join(jobs_dir, file_name)
-            f = open(file_path, "w")
-            f.write("\n".join(part) + "\n")
-            f.close()
+            buf = memoryview(b"\n".join(part) + b"\n")
+            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            while buf:  # os.write is not guaranteed to write everything at once
+                buf = buf[os.write(fd, buf):]
+            os.close(fd)
             to_combine.append(file_path)
     return to_combine
 
@@ -365,75 +467,50 @@ def main():
 
     # pre-compute chain : gene : region
     # collect the second list of skipped genes
-    regions, skipped_2 = precompute_regions(batch,
-                                            bed_data,
-                                            args.bdb_chain_file,
-                                            chain_gene_field,
-                                            args.chains_limit)
-    iter_num = 0
+    regions, regions_qmax, skipped_2 = precompute_regions(batch,
+                                                          bed_data,
+                                                          args.bdb_chain_file,
+                                                          chain_gene_field,
+                                                          args.chains_limit)
     all_jobs = {}
     skipped_3 = []
-
-    for gene in batch.keys():
+    extra = 100000  # for extra stuff
+
+    # proceed to memory estimation, compute it for all genes at once
+    genes = [gene for gene in batch.keys() if regions.get(gene)]
+    num_states = np.array([bed_data[gene][3] for gene in genes], dtype=np.int64)
+    rlength = np.array([bed_data[gene][4] for gene in genes], dtype=np.int64)
+    qlength_max = np.array([regions_qmax[gene] for gene in genes], dtype=np.int64)
+    memory = (num_states * 4 * 8) + \
+             (num_states * qlength_max * 4) + \
+             (num_states * 304) + \
+             (2 * qlength_max + rlength) * 8 + \
+             (qlength_max + rlength) * 2 * 1 + extra
+    gigs = np.ceil(memory / 1000000000) + 0.25  # convet to gigs + 0.25 extra gig
+
+    # parts of CESAR_wrapper call shared by all jobs
+    # gene chains bed_file bdb_chain_file tDB qDB --memlim gig --cesar_binary --uhq_flank
+    job_args = f"{args.bdb_bed_file} {args.bdb_chain_file} {args.tDB} {args.qDB}"
+    job_opts = f"--cesar_binary {args.cesar_binary} --uhq_flank {args.uhq_flank}"
+    job_opts += " --mask_stops" if args.mask_stops else ""
+    job_opts += " --check_loss" if args.check_loss else ""
+    job_opts += " --no_fpi" if args.no_fpi else ""
+    # U12 introns in this gene
+    job_opts_u12 = job_opts + f" --u12 {args.u12}"
+
+    for gene, gig in zip(genes, gigs.tolist()):
         u12_this_gene = U12_data.get(gene)
-        iter_num += 1
-        block_sizes = bed_data[gene][3]
-        extra = 100000  # for extra stuff
-        # chains_arg = ",".join(chains)
-
-        # proceed to memory estimation
-        num_states, rlength = 0, 0
-        # ref by ref
-        for block_size in block_sizes:
-            # num_states += 6 + 6 * reference->num_codons + 1 + 2 + 2 + 22 + 6;
-            #  /* 22 and 6 for acc and donor states */
-            num_codons = block_size // 3
-            num_states += 6 + 6 * num_codons + 1 + 2 + 2 + 22 + 6
-            # rlength += 11 + 6 * fasta.references[i]->length
-            # + donors[i]->length + acceptors[i]->length;
-            rlength += block_size
-
-        gene_chains_data = regions.get(gene)
-        if not gene_chains_data:
-            continue
-        elif len(gene_chains_data) == 0:
-            continue
-        chains = gene_chains_data.keys()
+        chains = [chain_id for chain_id, _ in regions[gene]]
         chains_arg = ",".join(chains)
 
-        query_lens = [v for v in gene_chains_data.values()]
-        qlength_max = max(query_lens)
-        memory = (num_states * 4 * 8) + \
-                 (num_states * qlength_max * 4) + \
-                 (num_states * 304) + \
-                 (2 * qlength_max + rlength) * 8 + \
-                 (qlength_max + rlength) * 2 * 1 + extra
-
-        gig = math.ceil(memory / 1000000000) + 0.25  # convet to gigs + 0.25 extra gig
         if gig > mem_limit:
             # it is going to consume TOO much memory
             skipped_3.append((gene, ",".join(chains),
                              f"memory limit ({mem_limit} gig) exceeded (needs {gig})"))
             continue
 
-        # # 0 gene; 1 chains; 2 bed_file; 3 bdb chain_file; 4 tDB; 5 qDB; 6 output; 7 cesar_bin
-        job = WRAPPER_TEMPLATE.format(gene, chains_arg,
-                                      args.bdb_bed_file,
-                                      args.bdb_chain_file,
-                                      args.tDB, args.qDB,
-                                      gig,
-                                      args.cesar_binary,
-                                      args.uhq_flank)
-        job = job + " --mask_stops" if args.mask_stops else job
-        job = job + " --check_loss" if args.check_loss else job
-        job = job + " --no_fpi" if args.no_fpi else job
-
-        # U12 introns in this gene
-        if u12_this_gene:
-            # u12_str_opt = ",".join([f"{x[0]}_{x[1]}" for x in u12_this_gene])
-            # job = job + f" --u12 {u12_str_opt}"
-            job = job + f" --u12 {args.u12}"
-
+        gene_opts = job_opts_u12 if u12_this_gene else job_opts
+        job = f"{CESAR_WRAPPER} {gene} {chains_arg} {job_args} --memlim {gig} {gene_opts}"
         all_jobs[job] = gig
 
     eprint(f"\nThere are {len(all_jobs.keys())} jobs in total.")